@@ -1,16 +1,49 @@
-from fastapi import FastAPI, Request, BackgroundTasks
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, RedirectResponse
 from pydantic import BaseModel
 from typing import Optional
 from book_generator import BookCreationWorkflow, StoryGeneratorAgent, CoherenceAgent, BookAssemblerAgent, IllustrationGeneratorAgent, StoryElementsAgent
+import anyio.to_thread
+import asyncio
+import io
 import os
 import tempfile
+import threading
 import uuid
+import redis
+from PIL import Image
+from cachetools import TTLCache
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import firestore, storage
+from google.cloud.storage import transfer_manager
+from requests.adapters import HTTPAdapter
 
 app = FastAPI()
 
+# The agent pipeline runs synchronously in worker threads via
+# run_in_threadpool, which draws from anyio's default limiter (also used
+# for sync endpoints); its default 40 tokens would cap concurrent story
+# generations, so raise it. asyncio.to_thread would NOT be governed by
+# this limiter — request-path offloads must use run_in_threadpool.
+@app.on_event("startup")
+async def _expand_threadpool():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 100
+
+# The event loop only keeps weak references to tasks, so fire-and-forget
+# work must be anchored here or it can be garbage-collected before it runs
+_pending_tasks: set = set()
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _pending_tasks.add(task)
+    task.add_done_callback(_pending_tasks.discard)
+    return task
+
 # Allow frontend to access the API (CORS)
 app.add_middleware(
     CORSMiddleware,
@@ -20,20 +53,81 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Job queue: book generation runs in a separate worker process (worker.py)
+# so multi-minute jobs survive API restarts and don't tie up the HTTP workers
+
+redis_client = redis.Redis(
+    host=os.environ.get("REDIS_HOST", "localhost"),
+    port=int(os.environ.get("REDIS_PORT", "6379")),
+)
+BOOK_JOBS_QUEUE = "book_jobs"
+
 # Firestore session helpers
 
 db = firestore.Client()
 SESSION_COLLECTION = "sessions"
 
+# Short-lived read cache so status polling (every 1-2 s per client)
+# doesn't hit Firestore on every call; writes invalidate immediately.
+# TTLCache is not thread-safe and this one is shared across endpoint
+# worker threads, so every access goes through the lock
+_session_cache = TTLCache(maxsize=10_000, ttl=0.5)
+_session_cache_lock = threading.Lock()
+
+def _invalidate_session_cache(session_id):
+    # Cache keys are (session_id, field_mask); drop every entry for the id
+    with _session_cache_lock:
+        for key in [k for k in _session_cache if k[0] == session_id]:
+            _session_cache.pop(key, None)
+
 def save_session(session_id, data):
     db.collection(SESSION_COLLECTION).document(session_id).set(data)
+    _invalidate_session_cache(session_id)
 
-def get_session(session_id):
-    doc = db.collection(SESSION_COLLECTION).document(session_id).get()
-    return doc.to_dict() if doc.exists else None
+def update_session(session_id, fields):
+    # Partial update: only the changed fields travel over the wire,
+    # instead of rewriting the whole session document
+    db.collection(SESSION_COLLECTION).document(session_id).update(fields)
+    _invalidate_session_cache(session_id)
+
+def get_session(session_id, fields=None):
+    # `fields` applies a Firestore field mask so hot callers (status
+    # polling) don't pull the full story/params payload on every read
+    cache_key = (session_id, tuple(fields) if fields else None)
+    with _session_cache_lock:
+        cached = _session_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    doc_ref = db.collection(SESSION_COLLECTION).document(session_id)
+    doc = doc_ref.get(field_paths=fields) if fields else doc_ref.get()
+    session = doc.to_dict() if doc.exists else None
+    if session is not None:
+        with _session_cache_lock:
+            _session_cache[cache_key] = session
+    return session
 
 def delete_session(session_id):
     db.collection(SESSION_COLLECTION).document(session_id).delete()
+    _invalidate_session_cache(session_id)
+
+def valid_session_id(session_id):
+    # Cheap O(1) guard so malformed/hostile IDs never reach Firestore
+    if not session_id:
+        return False
+    try:
+        uuid.UUID(session_id)
+    except (ValueError, AttributeError, TypeError):
+        return False
+    return True
+
+# Agents are stateless between runs (per-request state travels in the
+# explicit `memory` dict), so build them once instead of per request
+WORKFLOW = BookCreationWorkflow()
+STORY_AGENT = StoryGeneratorAgent(name="StoryGeneratorAgent")
+ELEMENTS_AGENT = StoryElementsAgent(name="StoryElementsAgent")
+COHERENCE_AGENT = CoherenceAgent(name="CoherenceAgent")
+ILLUSTRATION_AGENT = IllustrationGeneratorAgent(name="IllustrationGeneratorAgent")
+ASSEMBLER_AGENT = BookAssemblerAgent(name="BookAssemblerAgent")
 
 class BookRequest(BaseModel):
     randomize_all: bool = False
@@ -43,6 +137,14 @@ class BookRequest(BaseModel):
     custom_elements: Optional[str] = None
     setting: Optional[str] = None
 
+def _run_story_pipeline(params):
+    """Runs the synchronous agent chain; called from a worker thread."""
+    memory = {}
+    processed = WORKFLOW.sub_agents[0].run(params, memory=memory)
+    story = STORY_AGENT.run(processed, memory=memory)
+    elements = ELEMENTS_AGENT.run(story, memory=memory)
+    return processed, story, elements
+
 @app.post("/api/generate-story")
 async def generate_story(req: BookRequest):
     params = {"randomize_all": req.randomize_all}
@@ -52,14 +154,12 @@ async def generate_story(req: BookRequest):
     if req.custom_elements: params["custom_elements"] = req.custom_elements
     if req.setting: params["setting"] = req.setting
 
-    # Generate story
-    memory = {}
-    processed = BookCreationWorkflow().sub_agents[0].run(params, memory=memory)
-    story = StoryGeneratorAgent(name="StoryGeneratorAgent").run(processed, memory=memory)
-    elements = StoryElementsAgent(name="StoryElementsAgent").run(story, memory=memory)
+    # Run the blocking agent chain off the event loop so concurrent
+    # requests (status polls, downloads) aren't serialized behind it
+    processed, story, elements = await run_in_threadpool(_run_story_pipeline, params)
     session_id = str(uuid.uuid4())
     # Only generate narration (not the whole book)
-    save_session(session_id, {
+    await run_in_threadpool(save_session, session_id, {
         "params": processed,
         "story": story,
         "elements": elements,
@@ -71,22 +171,102 @@ async def generate_story(req: BookRequest):
     }
 
 GCS_BUCKET_NAME = "pixietales-books"
-storage_client = storage.Client()
+# Give the storage transport a pool large enough for the concurrent
+# illustration uploads, so parallel requests reuse warm TLS connections
+# instead of handshaking per blob
+_gcs_credentials, _ = google.auth.default()
+_gcs_http = AuthorizedSession(_gcs_credentials)
+_gcs_http.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=64))
+storage_client = storage.Client(_http=_gcs_http)
 bucket = storage_client.bucket(GCS_BUCKET_NAME)
 
-def upload_file_to_gcs(local_path, gcs_path):
+def configure_public_bucket():
+    """Idempotent bucket provisioning: uniform bucket-level access plus a
+    public-read IAM binding, so uploads don't need per-object ACL calls.
+    Safe to run on every boot; already-applied settings are left alone."""
+    bucket.reload()
+    if not bucket.iam_configuration.uniform_bucket_level_access_enabled:
+        bucket.iam_configuration.uniform_bucket_level_access_enabled = True
+        bucket.patch()
+    policy = bucket.get_iam_policy()
+    for binding in policy.bindings:
+        if binding["role"] == "roles/storage.objectViewer" and "allUsers" in binding.get("members", ()):
+            return
+    policy.bindings.append({"role": "roles/storage.objectViewer", "members": {"allUsers"}})
+    bucket.set_iam_policy(policy)
+
+@app.on_event("startup")
+async def _provision_bucket():
+    # Without the public-read binding every public_gcs_url 403s on a fresh
+    # bucket; a failure here (e.g. local dev without IAM rights) must not
+    # block serving, so it only logs
+    try:
+        await asyncio.to_thread(configure_public_bucket)
+    except Exception as e:
+        print(f"Bucket provisioning skipped: {e}")
+
+def public_gcs_url(gcs_path):
+    return f"https://storage.googleapis.com/{GCS_BUCKET_NAME}/{gcs_path}"
+
+# Signed download URLs are minted on demand by /api/download-book and
+# cached for far less than their signature lifetime, so a served link is
+# always freshly valid; the signed string is never persisted
+DOWNLOAD_URL_TTL_HOURS = 24
+_DOWNLOAD_URL_CACHE_SECS = 3600
+_download_urls = TTLCache(maxsize=10_000, ttl=_DOWNLOAD_URL_CACHE_SECS)
+_download_urls_lock = threading.Lock()
+
+def signed_download_url(gcs_path):
+    """V4-signed URL for `gcs_path`; falls back to the public URL when the
+    runtime credentials can't sign (e.g. plain ADC without a private key)."""
+    try:
+        blob = bucket.blob(gcs_path)
+        return blob.generate_signed_url(
+            expiration=timedelta(hours=DOWNLOAD_URL_TTL_HOURS), version="v4"
+        )
+    except Exception as e:
+        print(f"Signed URL unavailable, falling back to public URL: {e}")
+        return public_gcs_url(gcs_path)
+
+# Above this size, split the upload into chunks sent in parallel instead
+# of a single-stream resumable upload
+LARGE_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+def upload_stream_to_gcs(stream, gcs_path, content_type):
     blob = bucket.blob(gcs_path)
-    blob.upload_from_filename(local_path)
-    blob.make_public()
-    return blob.public_url
-
-def upload_illustrations_to_gcs(illustration_paths, session_id):
-    gcs_urls = []
-    for i, img_path in enumerate(illustration_paths):
-        gcs_img_path = f"books/{session_id}/illustration_{i}.png"
-        url = upload_file_to_gcs(img_path, gcs_img_path)
-        gcs_urls.append(url)
-    return gcs_urls
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    if size > LARGE_UPLOAD_CHUNK_SIZE:
+        # The chunked parallel path needs a filename, so spill the buffer
+        # to a temp file first; for a multi-MB PDF the parallel chunks
+        # more than recoup the extra local write
+        with tempfile.NamedTemporaryFile(delete=False) as tmp:
+            tmp.write(stream.getbuffer() if isinstance(stream, io.BytesIO) else stream.read())
+            tmp_path = tmp.name
+        try:
+            transfer_manager.upload_chunks_concurrently(
+                tmp_path, blob, content_type=content_type,
+                chunk_size=LARGE_UPLOAD_CHUNK_SIZE, max_workers=8,
+            )
+        finally:
+            os.remove(tmp_path)
+    else:
+        blob.upload_from_file(stream, content_type=content_type)
+    return public_gcs_url(gcs_path)
+
+UPLOAD_MAX_WORKERS = 16
+
+# Illustrations are served on the web at thumbnail size; the PDF embeds
+# the full-resolution originals
+WEB_ILLUSTRATION_SIZE = (768, 768)
+
+def upload_web_illustration(img_path, gcs_path):
+    img = Image.open(img_path)
+    img.thumbnail(WEB_ILLUSTRATION_SIZE)
+    buf = io.BytesIO()
+    img.save(buf, "WEBP", quality=85, method=4)
+    return upload_stream_to_gcs(buf, gcs_path, "image/webp")
 
 def cleanup_local_files(file_paths):
     for path in file_paths:
@@ -96,55 +276,83 @@ def cleanup_local_files(file_paths):
         except Exception as e:
             print(f"Failed to delete {path}: {e}")
 
+def cleanup_local_files_async(file_paths):
+    # Deleting temp files is best-effort housekeeping; detach it so it
+    # never sits between the user and the "done" status
+    threading.Thread(target=cleanup_local_files, args=(file_paths,), daemon=True).start()
+
 @app.post("/api/generate-book")
-async def generate_book(request: Request, background_tasks: BackgroundTasks):
+async def generate_book(request: Request):
     data = await request.json()
     session_id = data.get("session_id")
-    session = get_session(session_id)
+    if not valid_session_id(session_id):
+        return {"error": "Invalid session id"}
+    session = await run_in_threadpool(get_session, session_id)
     if not session:
         return {"error": "Session not found"}
-    # Set status to pending
-    session["status"] = "pending"
-    save_session(session_id, session)
-    # Start background book generation
-    background_tasks.add_task(run_book_generation, session_id)
+    # The pending marker is informational (the worker overwrites it with
+    # done/error), so don't block the response on the Firestore RTT
+    _spawn(run_in_threadpool(update_session, session_id, {"status": "pending"}))
+    # Enqueue for the worker pool; Firestore status is the progress signal
+    redis_client.lpush(BOOK_JOBS_QUEUE, session_id)
     return {"session_id": session_id, "status": "pending"}
 
 def run_book_generation(session_id):
     session = get_session(session_id)
     if not session:
         return
+    executor = ThreadPoolExecutor(max_workers=UPLOAD_MAX_WORKERS)
     try:
         params = session["params"]
         story = session["story"]
         memory = {"story": story}
-        prompts = CoherenceAgent(name="CoherenceAgent").run(story, params, memory=memory)
-        illustrations = IllustrationGeneratorAgent(name="IllustrationGeneratorAgent").run(
-            prompts, None, memory=memory
+        prompts = COHERENCE_AGENT.run(story, params, memory=memory)
+        # Pipeline: each illustration starts uploading to GCS the moment
+        # the agent writes it, hiding upload latency behind the
+        # remaining image-generation calls
+        illustration_futures = {}
+        def upload_illustration(i, img_path):
+            gcs_img_path = f"books/{session_id}/illustration_{i}.webp"
+            illustration_futures[i] = executor.submit(upload_web_illustration, img_path, gcs_img_path)
+        illustrations = ILLUSTRATION_AGENT.run(
+            prompts, None, memory=memory, on_image=upload_illustration
         )
         scenes = memory["scenes"] if "scenes" in memory else [story]
-        artifact = {}
-        BookAssemblerAgent(name="BookAssemblerAgent").run(scenes, illustrations, artifact=artifact)
+        # Assemble the PDF in memory and stream it straight to GCS,
+        # skipping the temp-file write/read/delete cycle
+        pdf_buf = io.BytesIO()
+        artifact = {"stream": pdf_buf}
+        ASSEMBLER_AGENT.run(scenes, illustrations, artifact=artifact)
         book_filename = "PixieLabs Book.pdf"
-        pdf_path = os.path.join(tempfile.gettempdir(), book_filename)
         gcs_pdf_path = f"books/{session_id}/{book_filename}"
-        pdf_url = upload_file_to_gcs(pdf_path, gcs_pdf_path)
-        gcs_illustration_urls = upload_illustrations_to_gcs(illustrations, session_id)
-        cleanup_local_files([pdf_path] + illustrations)
-        session["book_filename"] = book_filename
-        session["illustration_paths"] = illustrations
-        session["pdf_url"] = pdf_url
-        session["illustration_urls"] = gcs_illustration_urls
-        session["status"] = "done"
-        save_session(session_id, session)
+        pdf_future = executor.submit(upload_stream_to_gcs, pdf_buf, gcs_pdf_path, "application/pdf")
+        gcs_illustration_urls = [illustration_futures[i].result() for i in sorted(illustration_futures)]
+        pdf_url = pdf_future.result()
+        # One write with only the changed fields, instead of several
+        # full-document rewrites. Only the stable GCS path is stored;
+        # /api/download-book signs a fresh URL from it on demand
+        update_session(session_id, {
+            "book_filename": book_filename,
+            "illustration_paths": illustrations,
+            "pdf_url": pdf_url,
+            "pdf_gcs_path": gcs_pdf_path,
+            "illustration_urls": gcs_illustration_urls,
+            "status": "done",
+        })
+        cleanup_local_files_async(illustrations)
     except Exception as e:
-        session["status"] = "error"
-        session["error_message"] = str(e)
-        save_session(session_id, session)
+        update_session(session_id, {"status": "error", "error_message": str(e)})
+    finally:
+        executor.shutdown(wait=False)
 
 @app.get("/api/book-status")
 def book_status(session_id: str):
-    session = get_session(session_id)
+    if not valid_session_id(session_id):
+        return {"error": "Invalid session id"}
+    session = get_session(session_id, fields=[
+        "status", "pdf_url", "book_filename",
+        "illustration_urls", "error_message", "scenes",
+    ])
     if not session:
         return {"error": "Session not found"}
     status = session.get("status", "pending")
@@ -164,9 +372,23 @@ def book_status(session_id: str):
 
 @app.get("/api/download-book")
 def download_book(session_id: str):
-    session = get_session(session_id)
-    if not session:
-        return {"error": "Session not found"}
-    if "pdf_url" not in session:
-        return {"error": "PDF not found"}
-    return RedirectResponse(session["pdf_url"]) 
\ No newline at end of file
+    if not valid_session_id(session_id):
+        return {"error": "Invalid session id"}
+    # Sign on demand: the cache TTL (1 h) is far below the signature
+    # lifetime (24 h), so a link served from here is always freshly valid
+    with _download_urls_lock:
+        url = _download_urls.get(session_id)
+    if url is None:
+        session = get_session(session_id, fields=["pdf_gcs_path", "book_filename", "pdf_url"])
+        if not session:
+            return {"error": "Session not found"}
+        gcs_path = session.get("pdf_gcs_path")
+        if not gcs_path and session.get("book_filename"):
+            # Sessions written before pdf_gcs_path was stored
+            gcs_path = f"books/{session_id}/{session['book_filename']}"
+        url = signed_download_url(gcs_path) if gcs_path else session.get("pdf_url")
+        if not url:
+            return {"error": "PDF not found"}
+        with _download_urls_lock:
+            _download_urls[session_id] = url
+    return RedirectResponse(url) 
\ No newline at end of file
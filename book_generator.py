@@ -1,8 +1,16 @@
 from __future__ import annotations
 
+import base64
+import functools
+import hashlib
+import io
 import os
 import random
+import string
 import tempfile
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable, ClassVar, List, Tuple
 import time
 import re
@@ -10,7 +18,8 @@ import logging
 
 from pathlib import Path
 from dotenv import load_dotenv
-import json
+import orjson
+from cachetools import LRUCache
 from pydantic import Field
 from PIL import Image
 
@@ -19,10 +28,210 @@ load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
 import google.auth
 import google.auth.transport.requests
 import requests
-from google.adk.agents import Agent, SequentialAgent, ParallelAgent
+from google.adk.agents import Agent, SequentialAgent
+
+# reportlab is only required for PDF assembly; import it once here so the
+# hot page loop isn't re-resolving modules, and fail at run() time with a
+# clear message when it's missing
+_LEFT_MARGIN = 72
+_RIGHT_MARGIN = 72
+try:
+    from reportlab.lib.pagesizes import landscape, letter
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    from reportlab.pdfgen import canvas
+    _REPORTLAB_AVAILABLE = True
+    _PAGE_W, _PAGE_H = landscape(letter)
+    _MAX_TEXT_WIDTH = _PAGE_W - _LEFT_MARGIN - _RIGHT_MARGIN
+except ImportError:
+    _REPORTLAB_AVAILABLE = False
 
 logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
 
+# ────────────────────────────  Vertex AI helpers  ──────────────────────────────
+
+_AUTH_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+_auth_lock = threading.Lock()
+_credentials = None
+
+def _auth_headers() -> dict:
+    """Returns request headers with a bearer token, refreshing the cached
+    credentials only when they have expired (instead of once per call)."""
+    global _credentials
+    with _auth_lock:
+        if _credentials is None:
+            _credentials, _ = google.auth.default(scopes=_AUTH_SCOPES)
+        if not _credentials.valid:
+            _credentials.refresh(google.auth.transport.requests.Request())
+        return {
+            "Authorization": f"Bearer {_credentials.token}",
+            "Content-Type": "application/json; charset=utf-8",
+        }
+
+@functools.lru_cache(maxsize=None)
+def _vertex_model_url(model_id: str, action: str) -> str:
+    project = os.environ["GOOGLE_CLOUD_PROJECT"]
+    location = os.environ.get("GOOGLE_CLOUD_LOCATION", "us-central1")
+    model = (
+        f"projects/{project}/locations/{location}/publishers/google/"
+        f"models/{model_id}"
+    )
+    return f"https://{location}-aiplatform.googleapis.com/v1/{model}:{action}"
+
+# One pooled session for all Vertex calls so concurrent agents reuse
+# keep-alive connections instead of opening a TCP+TLS handshake per call
+_SESSION = requests.Session()
+_SESSION.mount("https://", requests.adapters.HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=requests.adapters.Retry(
+        total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]
+    ),
+))
+
+# Exact-match response cache: identical prompts (e.g. regenerating a
+# book with the same parameters) skip the Gemini round-trip entirely
+_llm_cache: LRUCache = LRUCache(maxsize=1024)
+_llm_cache_lock = threading.Lock()
+_llm_cache_hits = 0
+_llm_cache_misses = 0
+
+def cache_stats() -> dict:
+    """Hit/miss counters for the exact-match LLM response cache."""
+    with _llm_cache_lock:
+        return {
+            "hits": _llm_cache_hits,
+            "misses": _llm_cache_misses,
+            "size": len(_llm_cache),
+        }
+
+def _gemini_generate(prompt: str, *, cached_content: str | None = None, timeout: int = 60) -> str:
+    """Sends a single-turn prompt to Gemini and returns the concatenated
+    candidate text ("" when the response has no text parts).
+
+    `cached_content` names a Vertex cachedContents resource whose tokens
+    are prepended server-side (see _cached_prompt_prefix)."""
+    global _llm_cache_hits, _llm_cache_misses
+    key = hashlib.blake2b(
+        f"{cached_content}\x00{prompt}".encode(), digest_size=16
+    ).hexdigest()
+    with _llm_cache_lock:
+        if key in _llm_cache:
+            _llm_cache_hits += 1
+            return _llm_cache[key]
+        _llm_cache_misses += 1
+    text = _gemini_generate_uncached(prompt, cached_content=cached_content, timeout=timeout)
+    if text:
+        with _llm_cache_lock:
+            _llm_cache[key] = text
+    return text
+
+def _gemini_generate_uncached(prompt: str, *, cached_content: str | None = None, timeout: int = 60) -> str:
+    url = _vertex_model_url("gemini-2.0-flash-001", "streamGenerateContent")
+    data = {
+        "contents": [
+            {
+                "role": "user",
+                "parts": [{"text": prompt}],
+            }
+        ]
+    }
+    if cached_content is not None:
+        data["cachedContent"] = cached_content
+    # orjson serializes the payload; the auth headers already carry the
+    # application/json content type
+    r = _SESSION.post(url, data=orjson.dumps(data), headers=_auth_headers(), stream=True, timeout=timeout)
+    r.raise_for_status()
+    # Accumulate chunks and join once — repeated += on a str is
+    # quadratic in the response size
+    chunks = [line for line in r.iter_lines() if line]
+    response_text = b"\n".join(chunks).decode()
+    try:
+        response_json = orjson.loads(response_text)
+    except Exception as e:
+        print("Failed to parse Gemini response as JSON array:", e)
+        response_json = []
+    parts = []
+    for obj in response_json:
+        if "candidates" not in obj:
+            continue
+        for cand in obj["candidates"]:
+            for part in cand.get("content", {}).get("parts", []):
+                if "text" in part:
+                    parts.append(part["text"])
+    return "".join(parts)
+
+# Explicit Gemini prompt caching: constant prompt prefixes (the few-shot
+# examples) are uploaded once as a cachedContents resource, so each call
+# only sends the variable tail and the prefix tokens are billed at the
+# cached rate. Keyed by prefix hash; entries are recreated near expiry.
+_PROMPT_CACHE_TTL_SECS = 3600
+# Failed creates are remembered this long, so a prefix the API keeps
+# rejecting (e.g. below the minimum cacheable size) doesn't cost an extra
+# POST on every call
+_PROMPT_CACHE_RETRY_SECS = 300
+_prompt_cache_lock = threading.Lock()
+# key -> (resource name or None for a failed create, expiry timestamp)
+_prompt_caches: dict[str, tuple[str | None, float]] = {}
+
+def _cached_prompt_prefix(prefix: str) -> str | None:
+    """Returns the cachedContents resource name for `prefix`, creating or
+    refreshing it as needed. Returns None when caching is unavailable so
+    callers can fall back to sending the prefix inline."""
+    key = hashlib.blake2b(prefix.encode(), digest_size=16).hexdigest()
+    now = time.time()
+    with _prompt_cache_lock:
+        cached = _prompt_caches.get(key)
+        if cached is not None:
+            name, expiry = cached
+            if name is not None and now < expiry - 60:
+                return name
+            if name is None and now < expiry:
+                # Cooling down after a failed create
+                return None
+    # The create happens outside the lock so concurrent callers are never
+    # serialized behind the network round trip; a duplicate create during a
+    # race is harmless (last writer wins)
+    try:
+        project = os.environ["GOOGLE_CLOUD_PROJECT"]
+        location = os.environ.get("GOOGLE_CLOUD_LOCATION", "us-central1")
+        url = (
+            f"https://{location}-aiplatform.googleapis.com/v1/"
+            f"projects/{project}/locations/{location}/cachedContents"
+        )
+        data = {
+            "model": (
+                f"projects/{project}/locations/{location}/publishers/google/"
+                f"models/gemini-2.0-flash-001"
+            ),
+            "contents": [{"role": "user", "parts": [{"text": prefix}]}],
+            "ttl": f"{_PROMPT_CACHE_TTL_SECS}s",
+        }
+        r = _SESSION.post(url, data=orjson.dumps(data), headers=_auth_headers(), timeout=30)
+        r.raise_for_status()
+        name = r.json()["name"]
+        with _prompt_cache_lock:
+            _prompt_caches[key] = (name, now + _PROMPT_CACHE_TTL_SECS)
+        return name
+    except Exception as e:
+        print("Vertex cachedContents create failed:", e)
+        with _prompt_cache_lock:
+            _prompt_caches[key] = (None, now + _PROMPT_CACHE_RETRY_SECS)
+        return None
+
+# Compiled once at import; calling methods on the pattern objects skips
+# the re-module cache lookup on every invocation
+_SETTING_SUB = re.compile(r"\b(in|at|on) the [A-Za-z ]+", re.IGNORECASE)
+_SETTING_SEARCH = re.compile(r"\b(in|at|on) the ([A-Za-z ]+)", re.IGNORECASE)
+_JSON_OBJ = re.compile(r'\{.*?\}', re.DOTALL)
+_JSON_ARRAY = re.compile(r'\[.*\]', re.DOTALL)
+_SLUG_DASHES = re.compile(r'-+')
+# Maps every non-alphanumeric printable char to '-' in one C-level pass;
+# anything the table doesn't cover (non-ASCII, control chars) is swept up
+# by _SLUG_OTHER so the old [^a-z0-9]+ semantics are preserved
+_SLUG_TABLE = str.maketrans({c: '-' for c in string.printable if not c.isalnum()})
+_SLUG_OTHER = re.compile(r'[^a-z0-9-]+')
+
 # ────────────────────────────────  Leaf Agents  ────────────────────────────────
 
 class UserInputAgent(Agent):
@@ -55,17 +264,15 @@ class UserInputAgent(Agent):
             # User selected a setting from the dropdown; it takes priority
             processed["setting"] = user_setting
             if custom_elements:
-                import re
                 # Remove setting-related phrases from custom_elements
-                custom_elements_cleaned = re.sub(r"\b(in|at|on) the [A-Za-z ]+", "", custom_elements, flags=re.IGNORECASE)
+                custom_elements_cleaned = _SETTING_SUB.sub("", custom_elements)
                 processed["custom_elements"] = custom_elements_cleaned.strip() or None
             else:
                 processed["custom_elements"] = None
         elif custom_elements:
             processed["custom_elements"] = custom_elements if custom_elements else None
             # Try to detect a setting in the custom elements (simple heuristic: look for 'in the' or 'at the' or 'on the')
-            import re
-            setting_match = re.search(r"\b(in|at|on) the ([A-Za-z ]+)", custom_elements, re.IGNORECASE)
+            setting_match = _SETTING_SEARCH.search(custom_elements)
             if setting_match:
                 processed["setting"] = setting_match.group(0)[3:].strip()  # e.g., 'the jungle'
             else:
@@ -147,49 +354,7 @@ class StoryGeneratorAgent(Agent):
 
         story: str | None = None
         try:
-            project = os.environ["GOOGLE_CLOUD_PROJECT"]
-            location = os.environ.get("GOOGLE_CLOUD_LOCATION", "us-central1")
-            model = (
-                f"projects/{project}/locations/{location}/publishers/google/"
-                f"models/gemini-2.0-flash-001"
-            )
-            url = f"https://{location}-aiplatform.googleapis.com/v1/{model}:streamGenerateContent"
-            creds, _ = google.auth.default(
-                scopes=["https://www.googleapis.com/auth/cloud-platform"]
-            )
-            creds.refresh(google.auth.transport.requests.Request())
-            headers = {
-                "Authorization": f"Bearer {creds.token}",
-                "Content-Type": "application/json; charset=utf-8",
-            }
-            data = {
-                "contents": [
-                    {
-                        "role": "user",
-                        "parts": [{"text": prompt}],
-                    }
-                ]
-            }
-            r = requests.post(url, json=data, headers=headers, stream=True, timeout=60)
-            r.raise_for_status()
-            response_text = ""
-            for line in r.iter_lines():
-                if not line:
-                    continue
-                response_text += line.decode()
-            try:
-                response_json = json.loads(response_text)
-            except Exception as e:
-                print("Failed to parse Gemini response as JSON array:", e)
-                response_json = []
-            story = ""
-            for obj in response_json:
-                if "candidates" not in obj:
-                    continue
-                for cand in obj["candidates"]:
-                    for part in cand.get("content", {}).get("parts", []):
-                        if "text" in part:
-                            story += part["text"]
+            story = _gemini_generate(prompt)
             if not story:
                 raise RuntimeError("Gemini returned empty result")
         except Exception as e: 
@@ -203,6 +368,9 @@ class StoryGeneratorAgent(Agent):
 
         if memory is not None:
             memory["story"] = story
+            # Scene boundaries are needed by several downstream agents;
+            # compute them once here
+            memory["scenes"] = _split_scenes(story)
         if send is not None:
             send("CoherenceAgent", story)
         logging.info(f"[StoryGeneratorAgent] Output: {story[:200]}{'...' if len(story) > 200 else ''}")
@@ -213,48 +381,8 @@ class StorySummaryAgent(Agent):
     def run(self, story: str, *, memory: dict | None = None):
         try:
             # Use Gemini to summarize the story
-            project = os.environ["GOOGLE_CLOUD_PROJECT"]
-            location = os.environ.get("GOOGLE_CLOUD_LOCATION", "us-central1")
-            model = (
-                f"projects/{project}/locations/{location}/publishers/google/"
-                f"models/gemini-2.0-flash-001"
-            )
-            url = f"https://{location}-aiplatform.googleapis.com/v1/{model}:streamGenerateContent"
-            creds, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
-            creds.refresh(google.auth.transport.requests.Request())
-            headers = {
-                "Authorization": f"Bearer {creds.token}",
-                "Content-Type": "application/json; charset=utf-8",
-            }
             prompt = f"Summarize the following children's story in 2-3 sentences, focusing on the main character, setting, and main events.\n\nStory:\n{story}"
-            data = {
-                "contents": [
-                    {
-                        "role": "user",
-                        "parts": [{"text": prompt}],
-                    }
-                ]
-            }
-            r = requests.post(url, json=data, headers=headers, stream=True, timeout=60)
-            r.raise_for_status()
-            response_text = ""
-            for line in r.iter_lines():
-                if not line:
-                    continue
-                response_text += line.decode()
-            try:
-                response_json = json.loads(response_text)
-            except Exception as e:
-                print("Failed to parse Gemini response as JSON array (summary):", e)
-                response_json = []
-            summary = ""
-            for obj in response_json:
-                if "candidates" not in obj:
-                    continue
-                for cand in obj["candidates"]:
-                    for part in cand.get("content", {}).get("parts", []):
-                        if "text" in part:
-                            summary += part["text"]
+            summary = _gemini_generate(prompt)
             if not summary:
                 raise RuntimeError("Gemini returned empty summary")
         except Exception as e:
@@ -268,67 +396,39 @@ class StoryElementsAgent(Agent):
     """Extracts main character(s) and setting from the story using Gemini."""
     def run(self, story: str, *, memory: dict | None = None):
         logging.info(f"[StoryElementsAgent] Input story: {story[:200]}{'...' if len(story) > 200 else ''}")
+        # The character and setting were already decided by UserInputAgent
+        # for locally generated stories — reuse them and skip the Gemini
+        # extraction round-trip. The LLM path remains for stories that
+        # arrive without user params (e.g. ingested externally).
+        params = memory.get("user_params", {}) if memory else {}
+        if params.get("character_name") and params.get("setting"):
+            character = params["character_name"]
+            setting = params["setting"]
+            if memory is not None:
+                memory["character"] = character
+                memory["setting"] = setting
+            logging.info(f"[StoryElementsAgent] Reusing user params: character={character}, setting={setting}")
+            return {"character": character, "setting": setting}
         try:
-            project = os.environ["GOOGLE_CLOUD_PROJECT"]
-            location = os.environ.get("GOOGLE_CLOUD_LOCATION", "us-central1")
-            model = (
-                f"projects/{project}/locations/{location}/publishers/google/"
-                f"models/gemini-2.0-flash-001"
-            )
-            url = f"https://{location}-aiplatform.googleapis.com/v1/{model}:streamGenerateContent"
-            creds, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
-            creds.refresh(google.auth.transport.requests.Request())
-            headers = {
-                "Authorization": f"Bearer {creds.token}",
-                "Content-Type": "application/json; charset=utf-8",
-            }
             prompt = (
                 "Extract the main character's name and the main setting from the following children's story. "
                 "Respond ONLY in JSON, like: {\"character\": \"Barnaby\", \"setting\": \"Glimmering Glades\"}. "
                 "Do not include any explanation or extra text.\n\nStory:\n" + story
             )
-            data = {
-                "contents": [
-                    {
-                        "role": "user",
-                        "parts": [{"text": prompt}],
-                    }
-                ]
-            }
-            r = requests.post(url, json=data, headers=headers, stream=True, timeout=60)
-            r.raise_for_status()
-            response_text = ""
-            for line in r.iter_lines():
-                if not line:
-                    continue
-                response_text += line.decode()
-            print("Gemini raw response (elements):", response_text)
-            try:
-                response_json = json.loads(response_text)
-            except Exception as e:
-                print("Failed to parse Gemini response as JSON array (elements):", e)
-                response_json = []
+            json_text = _gemini_generate(prompt)
+            print("Gemini candidate text (elements):", json_text)
             character = None
             setting = None
-            for obj in response_json:
-                if "candidates" not in obj:
-                    continue
-                for cand in obj["candidates"]:
-                    for part in cand.get("content", {}).get("parts", []):
-                        if "text" in part:
-                            json_text = part["text"]
-                            print("Gemini candidate text (elements):", json_text)
-                            import re
-                            match = re.search(r'\{.*?\}', json_text, re.DOTALL)
-                            if match:
-                                try:
-                                    parsed = json.loads(match.group(0))
-                                    character = parsed.get("character")
-                                    setting = parsed.get("setting")
-                                    print("Parsed character:", character, "Parsed setting:", setting)
-                                except Exception as e2:
-                                    print("Failed to parse character/setting JSON (regex):", e2)
-                                    print("Raw JSON text:", match.group(0))
+            match = _JSON_OBJ.search(json_text)
+            if match:
+                try:
+                    parsed = orjson.loads(match.group(0))
+                    character = parsed.get("character")
+                    setting = parsed.get("setting")
+                    print("Parsed character:", character, "Parsed setting:", setting)
+                except Exception as e2:
+                    print("Failed to parse character/setting JSON (regex):", e2)
+                    print("Raw JSON text:", match.group(0))
             if not character:
                 character = "the main character"
             if not setting:
@@ -359,71 +459,49 @@ class PromptExampleAgent(Agent):
         ("The elephant splashes water on her friends to cool them down.", "An elephant playfully spraying water on other animals, everyone laughing."),
     ]
 
+    @classmethod
+    @functools.cache
+    def _prompt_prefix(cls) -> str:
+        """Constant preamble — task instructions, few-shot examples, and
+        the style block. Built once per process; this is also the exact
+        text uploaded as Vertex cached content."""
+        header = (
+            "You are an expert at writing image descriptions for a children's coloring book.\n"
+            "For each scene, describe a simple, childlike doodle that shows the main character(s) doing the main action in the setting. "
+            "Include the key action, setting, and emotion, but keep the drawing simple and easy to color.\n"
+            "Do NOT draw any people, humans, or stick-figures of people.\n"
+            "The drawing should look like a child's doodle, with only outlines, no color, no shading, no background, and no text.\n\n"
+        )
+        examples = ''.join(
+            f"Scene: {ex_scene}\nImage: {ex_img}\n\n"
+            for ex_scene, ex_img in cls.FEW_SHOT_EXAMPLES
+        )
+        # Style instructions (repeated and at the end for emphasis)
+        footer = (
+            "\nIMPORTANT STYLE INSTRUCTIONS (repeat):\n"
+            "- ONLY outlines, black and white, no color.\n"
+            "- NO shading, NO background, NO details, NO text, NO numbers.\n"
+            "- The simplest possible lines, like a child's doodle of an animal.\n"
+            "- The drawing should look like a child's doodle, not a professional illustration.\n"
+            "- If you add any people, stick-figures of people, or realism, you will lose points. Simpler is better.\n\n"
+        )
+        return header + examples + footer
+
     def run(self, story: str, scene: str, *, memory: dict | None = None):
         logging.info(f"[PromptExampleAgent] Input scene: {scene}")
         try:
-            project = os.environ["GOOGLE_CLOUD_PROJECT"]
-            location = os.environ.get("GOOGLE_CLOUD_LOCATION", "us-central1")
-            model = (
-                f"projects/{project}/locations/{location}/publishers/google/"
-                f"models/gemini-2.0-flash-001"
-            )
-            url = f"https://{location}-aiplatform.googleapis.com/v1/{model}:streamGenerateContent"
-            creds, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
-            creds.refresh(google.auth.transport.requests.Request())
-            headers = {
-                "Authorization": f"Bearer {creds.token}",
-                "Content-Type": "application/json; charset=utf-8",
-            }
-            prompt = (
-                "You are an expert at writing image descriptions for a children's coloring book.\n"
-                "For each scene, describe a simple, childlike doodle that shows the main character(s) doing the main action in the setting. "
-                "Include the key action, setting, and emotion, but keep the drawing simple and easy to color.\n"
-                "Do NOT draw any people, humans, or stick-figures of people.\n"
-                "The drawing should look like a child's doodle, with only outlines, no color, no shading, no background, and no text.\n\n"
-            )
-            # Add few-shot examples (context-rich)
-            for ex_scene, ex_img in self.FEW_SHOT_EXAMPLES:
-                prompt += f"Scene: {ex_scene}\nImage: {ex_img}\n\n"
-            # Style instructions (repeated and at the end for emphasis)
-            prompt += (
-                "\nIMPORTANT STYLE INSTRUCTIONS (repeat):\n"
-                "- ONLY outlines, black and white, no color.\n"
-                "- NO shading, NO background, NO details, NO text, NO numbers.\n"
-                "- The simplest possible lines, like a child's doodle of an animal.\n"
-                "- The drawing should look like a child's doodle, not a professional illustration.\n"
-                "- If you add any people, stick-figures of people, or realism, you will lose points. Simpler is better.\n\n"
+            prefix = self._prompt_prefix()
+            suffix = (
                 "Now, for the following scene, write the image description in this simple, childlike animal doodle style.\n\n"
                 f"Scene: {scene}\nImage:"
             )
-            data = {
-                "contents": [
-                    {
-                        "role": "user",
-                        "parts": [{"text": prompt}],
-                    }
-                ]
-            }
-            r = requests.post(url, json=data, headers=headers, stream=True, timeout=60)
-            r.raise_for_status()
-            response_text = ""
-            for line in r.iter_lines():
-                if not line:
-                    continue
-                response_text += line.decode()
-            try:
-                response_json = json.loads(response_text)
-            except Exception as e:
-                print("Failed to parse Gemini response as JSON array (prompt example):", e)
-                response_json = []
-            img_desc = ""
-            for obj in response_json:
-                if "candidates" not in obj:
-                    continue
-                for cand in obj["candidates"]:
-                    for part in cand.get("content", {}).get("parts", []):
-                        if "text" in part:
-                            img_desc += part["text"]
+            # Send only the variable tail when the constant prefix is
+            # available as server-side cached content
+            cache_name = _cached_prompt_prefix(prefix)
+            if cache_name is not None:
+                img_desc = _gemini_generate(suffix, cached_content=cache_name)
+            else:
+                img_desc = _gemini_generate(prefix + suffix)
             if not img_desc:
                 img_desc = "A simple doodle showing the main character(s) doing the main action in the setting."
         except Exception as e:
@@ -434,6 +512,41 @@ class PromptExampleAgent(Agent):
         logging.info(f"[PromptExampleAgent] Output: {img_desc}")
         return img_desc.strip()
 
+    def run_batch(self, story: str, scenes: list[str], *, memory: dict | None = None) -> list[str]:
+        """Describes all scenes with one Gemini call, so the few-shot
+        preamble is sent (and billed) once per book instead of per scene."""
+        logging.info(f"[PromptExampleAgent] Batch input: {len(scenes)} scenes")
+        try:
+            prefix = self._prompt_prefix()
+            suffix = (
+                f"Now, for each of the following {len(scenes)} scenes, write the image description "
+                "in this simple, childlike animal doodle style.\n"
+                f"Respond ONLY with a JSON array of {len(scenes)} strings, one description per scene, in order.\n\n"
+            )
+            for idx, scene in enumerate(scenes, 1):
+                suffix += f"Scene {idx}: {scene}\n\n"
+            cache_name = _cached_prompt_prefix(prefix)
+            if cache_name is not None:
+                text = _gemini_generate(suffix, cached_content=cache_name)
+            else:
+                text = _gemini_generate(prefix + suffix)
+            match = _JSON_ARRAY.search(text)
+            img_descs = orjson.loads(match.group(0) if match else text)
+            if not isinstance(img_descs, list) or len(img_descs) != len(scenes):
+                raise ValueError(f"Expected {len(scenes)} descriptions, got: {text[:200]}")
+            img_descs = [str(desc).strip() for desc in img_descs]
+        except Exception as e:
+            print("Gemini batch prompt example call failed:", e)
+            # Fall back to per-scene calls, dispatched concurrently
+            with ThreadPoolExecutor(max_workers=max(len(scenes), 1)) as executor:
+                return list(executor.map(
+                    lambda scene: self.run(story, scene, memory=memory), scenes
+                ))
+        if memory is not None:
+            memory.setdefault("img_descs", []).extend(img_descs)
+        logging.info(f"[PromptExampleAgent] Batch output: {img_descs}")
+        return img_descs
+
 class CoherenceAgent(Agent):
     """Splits story into scenes (by paragraph) & crafts illustration prompts."""
 
@@ -446,8 +559,11 @@ class CoherenceAgent(Agent):
         send: Callable | None = None,
     ):
         logging.info(f"[CoherenceAgent] Input story: {story[:200]}{'...' if len(story) > 200 else ''}")
-        # Split story into scenes by paragraph (double newlines)
-        raw_scenes = [p.strip() for p in story.split('\n\n') if p.strip()]
+        # Reuse scene boundaries computed by StoryGeneratorAgent; split
+        # by paragraph only when the story arrived without them
+        raw_scenes = memory.get("scenes") if memory else None
+        if not raw_scenes:
+            raw_scenes = _split_scenes(story)
         character = memory["character"] if memory and "character" in memory else "the main character"
         setting = memory["setting"] if memory and "setting" in memory else "the main setting"
         animal = params["animal"] if "animal" in params else "animal"
@@ -458,13 +574,17 @@ class CoherenceAgent(Agent):
             "• NO shading, NO background, NO details, NO color, NO text, NO numbers.\n"
             "• The drawing should look like a child's doodle, not a professional illustration.\n"
         )
-        prompts = []
         prompt_agent = PromptExampleAgent(name="PromptExampleAgent")
-        for scene in raw_scenes:
-            context = (
-                f"{style_info}Animal: {animal}\nSetting: {setting}\n\nScene: {scene}\nImage:"
-            )
-            img_desc = prompt_agent.run(story, context)
+        contexts = [
+            f"{style_info}Animal: {animal}\nSetting: {setting}\n\nScene: {scene}\nImage:"
+            for scene in raw_scenes
+        ]
+        # One batched Gemini call covers every scene, sending the few-shot
+        # preamble once; run_batch falls back to concurrent per-scene
+        # calls if the batched response can't be parsed
+        img_descs = prompt_agent.run_batch(story, contexts)
+        prompts = []
+        for scene, context, img_desc in zip(raw_scenes, contexts, img_descs):
             prompt = style_info + img_desc
             logging.info(f"[CoherenceAgent] Scene: {scene}")
             logging.info(f"[CoherenceAgent] Prompt sent to PromptExampleAgent: {context}")
@@ -481,6 +601,9 @@ class CoherenceAgent(Agent):
 class IllustrationGeneratorAgent(Agent):
     """Generates illustrations using Vertex AI Imagen 4."""
 
+    # Concurrent predict calls, sized to the Imagen QPS quota
+    MAX_CONCURRENCY: ClassVar[int] = 4
+
     def run(
         self,
         prompts: list[str],
@@ -488,25 +611,12 @@ class IllustrationGeneratorAgent(Agent):
         *,
         memory: dict | None = None,
         artifact: dict | None = None,
+        on_image: Callable | None = None,
     ):
         logging.info(f"[IllustrationGeneratorAgent] Received {len(prompts)} prompts.")
-        import base64
-        images = []
-        project = os.environ["GOOGLE_CLOUD_PROJECT"]
-        location = os.environ.get("GOOGLE_CLOUD_LOCATION", "us-central1")
-        model = (
-            f"projects/{project}/locations/{location}/publishers/google/"
-            f"models/imagegeneration"
-        )
-        url = f"https://{location}-aiplatform.googleapis.com/v1/{model}:predict"
-        creds, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
-        creds.refresh(google.auth.transport.requests.Request())
-        headers = {
-            "Authorization": f"Bearer {creds.token}",
-            "Content-Type": "application/json; charset=utf-8",
-        }
-        max_images = len(prompts) 
-        for i, prompt in enumerate(prompts[:max_images]):
+        url = _vertex_model_url("imagegeneration", "predict")
+        headers = _auth_headers()
+        def generate_one(i: int, prompt: str) -> str:
             logging.info(f"[IllustrationGeneratorAgent] Prompt {i}: {prompt}")
             data = {
                 "instances": [
@@ -515,53 +625,150 @@ class IllustrationGeneratorAgent(Agent):
             }
             for attempt in range(2):  # Try up to 2 times
                 try:
-                    r = requests.post(url, json=data, headers=headers, timeout=120)
+                    _imagen_limiter.acquire()
+                    r = _SESSION.post(url, data=orjson.dumps(data), headers=headers, timeout=120)
                     r.raise_for_status()
-                    resp = r.json()
+                    # Parse straight from the response bytes — r.json()
+                    # would first materialize the ~MB base64 payload as a
+                    # separate Python str
+                    resp = orjson.loads(r.content)
                     if "predictions" in resp and resp["predictions"]:
                         img_b64 = resp["predictions"][0]["bytesBase64Encoded"]
-                        img_bytes = base64.b64decode(img_b64)
                         img_path = os.path.join(tempfile.gettempdir(), f"illustration_{i}.png")
-                        with open(img_path, "wb") as f:
-                            f.write(img_bytes)
-                        images.append(img_path)
+                        _decode_and_write(img_b64, img_path)
                         logging.info(f"[IllustrationGeneratorAgent] Saved image {i}: {img_path}")
-                        break
-                    else:
-                        logging.warning(f"Empty or unexpected response for prompt {i}: {resp}")
-                        if attempt == 0:
-                            time.sleep(10)
-                        else:
-                            images.append(f"mock_image_{i}.png")
+                        # Let the caller start uploading/post-processing this
+                        # image while the remaining prompts are generated
+                        if on_image is not None:
+                            on_image(i, img_path)
+                        return img_path
+                    logging.warning(f"Empty or unexpected response for prompt {i}: {resp}")
+                    if attempt == 0:
+                        time.sleep(_retry_backoff(attempt))
                 except requests.exceptions.HTTPError as e:
                     if r.status_code == 429:
-                        print(f"429 Too Many Requests for prompt {i}, retrying after delay...")
-                        time.sleep(10)  # Wait 10 seconds and retry once
+                        backoff = _retry_backoff(attempt)
+                        print(f"429 Too Many Requests for prompt {i}, retrying after {backoff:.1f}s...")
+                        time.sleep(backoff)
                         continue
-                    else:
-                        print(f"Imagen API call failed for prompt {i}: {e}")
-                        if attempt == 0:
-                            time.sleep(10)
-                        else:
-                            images.append(f"mock_image_{i}.png")
+                    print(f"Imagen API call failed for prompt {i}: {e}")
+                    if attempt == 0:
+                        time.sleep(_retry_backoff(attempt))
                 except Exception as e:
                     print(f"Imagen API call failed for prompt {i}: {e}")
                     if attempt == 0:
-                        time.sleep(10)
-                    else:
-                        images.append(f"mock_image_{i}.png")
+                        time.sleep(_retry_backoff(attempt))
+            return f"mock_image_{i}.png"
+
+        # Each prompt is an independent predict call; run them through a
+        # pool bounded to Imagen's QPS quota. executor.map preserves
+        # prompt order in the result list.
+        with ThreadPoolExecutor(max_workers=self.MAX_CONCURRENCY) as executor:
+            images = list(executor.map(lambda args: generate_one(*args), enumerate(prompts)))
         logging.info(f"[IllustrationGeneratorAgent] Output images: {images}")
         if artifact is not None:
             artifact["illustrations"] = images
         return images
 
+def _retry_backoff(attempt: int) -> float:
+    # Exponential with jitter so concurrent workers don't retry in lockstep
+    return min(2 ** attempt, 30) + random.uniform(0, 1)
+
+class _RateLimiter:
+    """Minimal thread-safe pacing: spaces request starts so at most
+    `max_rate` begin per `period` seconds, matching the Imagen quota."""
+
+    def __init__(self, max_rate: int, period: float = 1.0):
+        self.interval = period / max_rate
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+_imagen_limiter = _RateLimiter(max_rate=4)
+
+def _decode_and_write(img_b64: str, img_path: str) -> None:
+    # Runs on an illustration worker thread, so the CPU-bound decode and
+    # the disk write never block the dispatch of other prompts. No
+    # flush/fsync: the assembler re-reads the file in-process moments
+    # later, so the page cache is sufficient.
+    with open(img_path, "wb") as f:
+        f.write(base64.b64decode(img_b64))
+
+_PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+
+def _split_scenes(story: str) -> list[str]:
+    """Splits a story into paragraph scenes (blank-line separated) in a
+    single pass over its lines."""
+    scenes: list[str] = []
+    current: list[str] = []
+    for line in story.splitlines():
+        if line.strip():
+            current.append(line)
+        elif current:
+            scenes.append("\n".join(current).strip())
+            current = []
+    if current:
+        scenes.append("\n".join(current).strip())
+    return scenes
+
+@functools.lru_cache(maxsize=4096)
+def _word_width(word: str, font: str = "Helvetica", size: int = 12) -> float:
+    return stringWidth(word, font, size)
+
+def _wrap_words(text: str, max_width: float, font: str = "Helvetica", size: int = 12) -> list[str]:
+    """Greedy line wrap using one width measurement per word instead of
+    re-measuring the whole line for every candidate word."""
+    space_w = _word_width(" ", font, size)
+    lines: list[str] = []
+    current: list[str] = []
+    current_w = 0.0
+    for word in text.split():
+        word_w = _word_width(word, font, size)
+        added_w = word_w + (space_w if current else 0.0)
+        if current and current_w + added_w > max_width:
+            lines.append(" ".join(current))
+            current = [word]
+            current_w = word_w
+        else:
+            current.append(word)
+            current_w += added_w
+    if current:
+        lines.append(" ".join(current))
+    return lines
+
 def slugify(value: str) -> str:
-    import re
-    value = value.lower()
-    value = re.sub(r'[^a-z0-9]+', '-', value)
-    value = re.sub(r'-+', '-', value)
-    value = value.strip('-')
-    return value or 'book'
+    value = value.lower().translate(_SLUG_TABLE)
+    value = _SLUG_OTHER.sub('-', value)
+    return _SLUG_DASHES.sub('-', value).strip('-') or 'book'
+
+# Books longer than this skip the in-memory PDF buffer and stream pages to
+# disk as they complete, keeping peak memory flat over page count
+_LARGE_BOOK_PAGES = 500
+# How many prepared pages may be in flight ahead of the canvas on the
+# long-book path; bounds prep memory while still overlapping with drawing
+_PREP_WINDOW = 16
+
+def _bounded_map(pool, fn, items, window):
+    """Like pool.map, but keeps at most `window` tasks in flight so results
+    can be consumed incrementally without materializing every output."""
+    pending = deque()
+    it = iter(items)
+    for item in it:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= window:
+            break
+    for item in it:
+        yield pending.popleft().result()
+        pending.append(pool.submit(fn, item))
+    while pending:
+        yield pending.popleft().result()
 
 class BookAssemblerAgent(Agent):
     """Combines story & images into a PDF (reportlab)."""
@@ -572,114 +779,193 @@ class BookAssemblerAgent(Agent):
         illustrations: list[str],
         title: str = "Children's Book",
         *,
+        character: str | None = None,
+        setting: str | None = None,
         artifact: dict | None = None,
     ):
         logging.info(f"[BookAssemblerAgent] Assembling PDF with {len(illustrations)} illustrations.")
-        try:
-            from reportlab.lib.pagesizes import letter, landscape
-            from reportlab.pdfgen import canvas
-            from reportlab.lib.utils import ImageReader
-        except ImportError as exc:
-            raise RuntimeError("Install reportlab to enable PDF output") from exc
+        if not _REPORTLAB_AVAILABLE:
+            raise RuntimeError("Install reportlab to enable PDF output")
+        if character and setting:
+            # Title is only ever drawn on the cover, so format it here from
+            # the components instead of allocating it in every caller
+            title = f"{character} in {setting}"
 
         temp_dir = tempfile.gettempdir()
         pdf_filename = "PixieLabs Book.pdf"
-        pdf_path = os.path.join(temp_dir, pdf_filename)
-        c = canvas.Canvas(pdf_path, pagesize=landscape(letter))
-        width, height = landscape(letter)
+        # Render into a caller-supplied stream (e.g. io.BytesIO destined
+        # for GCS) when given, so the PDF never touches local disk
+        stream = artifact.get("stream") if artifact is not None else None
+        if stream is not None:
+            pdf_path = None
+            buf = stream
+        elif len(scenes) > _LARGE_BOOK_PAGES:
+            # reportlab flushes completed pages straight to a file target, so
+            # huge books never hold the whole document in RAM
+            pdf_path = os.path.join(temp_dir, pdf_filename)
+            buf = None
+        else:
+            # Build the PDF in memory and write the file in one pass below,
+            # instead of reportlab's incremental per-page file writes
+            pdf_path = os.path.join(temp_dir, pdf_filename)
+            buf = io.BytesIO()
+        # pageCompression deflates each content stream as the page completes,
+        # shrinking the output without a separate rewrite pass
+        c = canvas.Canvas(buf if buf is not None else pdf_path,
+                          pagesize=(_PAGE_W, _PAGE_H), pageCompression=1)
+        width, height = _PAGE_W, _PAGE_H
+
+        # Track the canvas font and skip redundant setFont operators; showPage
+        # resets graphics state, so the tracker is cleared at each page break
+        current_font = None
 
-        c.setFont("Helvetica-Bold", 24)
+        def set_font(name, size):
+            nonlocal current_font
+            if current_font != (name, size):
+                c.setFont(name, size)
+                current_font = (name, size)
+
+        def draw_placeholder(caption):
+            # Shared by the missing-image and failed-image branches
+            set_font("Helvetica-Oblique", 10)
+            c.drawString(_LEFT_MARGIN, image_bottom + 10, caption)
+
+        set_font("Helvetica-Bold", 24)
         c.drawCentredString(width / 2, height - 80, title)
-        c.setFont("Helvetica", 14)
+        set_font("Helvetica", 14)
         c.drawCentredString(width / 2, height - 110, "Generated by ADK")
         c.showPage()
+        current_font = None
 
-        temp_jpegs = []
-        for i, (scene, img_path) in enumerate(zip(scenes, illustrations)):
-            c.setFont("Helvetica-Bold", 16)
-            text_top_y = height - 60 
-            left_margin = 72
-            right_margin = 72
-            max_text_width = width - left_margin - right_margin
-            from reportlab.pdfbase.pdfmetrics import stringWidth
-            words = scene.split()
-            lines = []
-            current_line = ""
-            for word in words:
-                test_line = current_line + (" " if current_line else "") + word
-                if stringWidth(test_line, "Helvetica", 12) <= max_text_width:
-                    current_line = test_line
-                else:
-                    lines.append(current_line)
-                    current_line = word
-            if current_line:
-                lines.append(current_line)
-            c.setFont("Helvetica", 12)
-            text_y = text_top_y
-            for line in lines:
-                c.drawString(left_margin, text_y, line)
-                text_y -= 16  
-            # Calculate available space for image
-            image_top = text_y - 10  
-            image_bottom = 40  
-            image_height = image_top - image_bottom
-            image_left = left_margin
-            image_right = width - right_margin
-            image_width = image_right - image_left
-            jpeg_path = None
-            if img_path and os.path.exists(img_path) and img_path.endswith('.png'):
-                try:
-                    # Convert to JPEG, pre-scale to fit PDF
-                    with Image.open(img_path) as im:
+        # One ImageReader per unique illustration path; reportlab then embeds
+        # a single XObject for repeated images instead of re-decoding and
+        # storing a fresh copy on every page
+        img_cache = {}
+        img_cache_lock = threading.Lock()
+        text_top_y = height - 60
+        image_bottom = 40
+
+        def prepare_page(args):
+            # Wrap text and convert the illustration off the canvas thread;
+            # PIL and zlib release the GIL, so page prep overlaps across cores
+            # while the canvas itself stays single-threaded
+            i, scene, img_path = args
+            lines = _wrap_words(scene, _MAX_TEXT_WIDTH)
+            text_y = text_top_y - 16 * len(lines)
+            image_height = (text_y - 10) - image_bottom
+            image_width = _MAX_TEXT_WIDTH
+            if not img_path:
+                return lines, None, None
+            with img_cache_lock:
+                img = img_cache.get(img_path)
+            if img is not None:
+                return lines, img, None
+            try:
+                # Decode once, pre-scale to ~2x the draw box (roughly 144 dpi
+                # on the page), then hand the live PIL image to reportlab:
+                # no PNG/JPEG re-encode on our side, and repeated draws of the
+                # same illustration reuse the cached reader. A single open
+                # serves both the magic-byte validation and the decode; a
+                # failed open doubles as the existence check.
+                t_conv0 = time.time()
+                with open(img_path, "rb") as f:
+                    if f.read(8) != _PNG_MAGIC:
+                        return lines, None, None
+                    f.seek(0)
+                    with Image.open(f) as im:
                         rgb_im = im.convert('RGB')
-                        orig_width, orig_height = rgb_im.size
-                        scale = min(image_width / orig_width, image_height / orig_height, 1.0)
-                        new_width = int(orig_width * scale)
-                        new_height = int(orig_height * scale)
-                        t_conv0 = time.time()
-                        if scale < 1.0:
-                            rgb_im = rgb_im.resize((new_width, new_height), Image.LANCZOS)
-                        jpeg_path = os.path.join(temp_dir, f"illustration_{i}.jpg")
-                        rgb_im.save(jpeg_path, 'JPEG', quality=70)
-                        t_conv1 = time.time()
-                        temp_jpegs.append(jpeg_path)
-                    file_size = os.path.getsize(jpeg_path)
-                    logging.info(f"[BookAssemblerAgent] Image {i} JPEG file size: {file_size/1024:.1f} KB, dimensions: {new_width}x{new_height}, conversion time: {t_conv1-t_conv0:.2f}s")
+                orig_width, orig_height = rgb_im.size
+                rgb_im.thumbnail((int(image_width * 2), int(image_height * 2)), Image.LANCZOS)
+                new_width, new_height = rgb_im.size
+                t_conv1 = time.time()
+                logging.info(f"[BookAssemblerAgent] Image {i} decoded: {new_width}x{new_height} (orig {orig_width}x{orig_height}), prep time: {t_conv1-t_conv0:.2f}s")
+                img = ImageReader(rgb_im)
+                with img_cache_lock:
+                    img = img_cache.setdefault(img_path, img)
+                return lines, img, None
+            except OSError:
+                # Missing or unreadable file: plain text-only placeholder,
+                # matching the old exists() behavior for mock image names
+                return lines, None, None
+            except Exception as e:
+                logging.exception(f"[BookAssemblerAgent] Failed to load illustration {img_path}")
+                return lines, None, e
+
+        page_args = [(i, scene, img_path) for i, (scene, img_path) in enumerate(zip(scenes, illustrations))]
+        page_count = len(page_args)
+        large_book = page_count > _LARGE_BOOK_PAGES
+        # On the long-book path each reader is dropped after its last page,
+        # so the cache never accumulates O(pages) decoded images
+        uses_left = Counter(a[2] for a in page_args) if large_book else None
+
+        page_numbers = [f"Page {k}" for k in range(1, page_count + 1)]
+        # Loop-invariant geometry, plus hot canvas methods bound once to skip
+        # the attribute lookups inside the loop
+        image_left = _LEFT_MARGIN
+        image_right = width - _RIGHT_MARGIN
+        image_width = image_right - image_left
+        begin_text = c.beginText
+        draw_text = c.drawText
+        draw_image = c.drawImage
+        draw_right_string = c.drawRightString
+        show_page = c.showPage
+        with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as pool:
+            if large_book:
+                # Bounded prefetch: at most _PREP_WINDOW prepared pages are
+                # alive at once, so prep memory stays flat over page count
+                # while still overlapping with drawing
+                pages = _bounded_map(pool, prepare_page, page_args, _PREP_WINDOW)
+            else:
+                pages = list(pool.map(prepare_page, page_args))
+            for i, (img_path, (lines, img, img_error)) in enumerate(zip(illustrations, pages)):
+                # One TextObject emits a single BT..ET block for all lines,
+                # instead of separate drawString state changes per line
+                text = begin_text(image_left, text_top_y)
+                text.setFont("Helvetica", 12)
+                text.setLeading(16)
+                for line in lines:
+                    text.textLine(line)
+                draw_text(text)
+                text_y = text_top_y - 16 * len(lines)
+                # Available image height depends on how many text lines this page has
+                image_top = text_y - 10
+                image_height = image_top - image_bottom
+                if img is not None:
                     t0 = time.time()
-                    img = ImageReader(jpeg_path)
-                    t1 = time.time()
-                    img_width, img_height = img.getSize()
-                    t2 = time.time()
-                    img_x = image_left + (image_width - img_width) / 2
-                    img_y = image_bottom + (image_height - img_height) / 2
-                    c.drawImage(img, img_x, img_y, img_width, img_height)
-                    t3 = time.time()
-                    draw_time = t3 - t2
-                    log_msg = f"[BookAssemblerAgent] Embedding image {i}: {jpeg_path} (load: {t1-t0:.2f}s, getSize: {t2-t1:.2f}s, draw: {draw_time:.2f}s)"
+                    # reportlab fits and centres the image in the box in C-side
+                    # code, replacing the per-page scale/offset math we had here
+                    draw_image(img, image_left, image_bottom, image_width, image_height,
+                               preserveAspectRatio=True, anchor='c', mask='auto')
+                    draw_time = time.time() - t0
+                    log_msg = f"[BookAssemblerAgent] Embedding image {i}: {img_path} (draw: {draw_time:.2f}s)"
                     if draw_time > 2.0:
-                        logging.warning(f"SLOW EMBED: {log_msg} | JPEG size: {file_size/1024:.1f} KB, dims: {img_width}x{img_height}, orig: {orig_width}x{orig_height}")
+                        logging.warning(f"SLOW EMBED: {log_msg}")
                     else:
                         logging.info(log_msg)
-                except Exception as e:
-                    c.setFont("Helvetica-Oblique", 10)
-                    c.drawString(left_margin, image_bottom + 10, f"[Failed to load illustration: {img_path}] {e}")
-            else:
-                c.setFont("Helvetica-Oblique", 10)
-                c.drawString(left_margin, image_bottom + 10, f"[Illustration: {img_path}]")
-            c.setFont("Helvetica", 10)
-            page_num_text = f"Page {i + 1}"
-            c.drawRightString(width - right_margin, 24, page_num_text)
-            c.showPage()
+                elif img_error is not None:
+                    draw_placeholder(f"[Failed to load illustration: {img_path}] {img_error}")
+                else:
+                    draw_placeholder(f"[Illustration: {img_path}]")
+                set_font("Helvetica", 10)
+                draw_right_string(image_right, 24, page_numbers[i])
+                show_page()
+                current_font = None
+                if uses_left is not None:
+                    uses_left[img_path] -= 1
+                    if uses_left[img_path] <= 0:
+                        with img_cache_lock:
+                            img_cache.pop(img_path, None)
         c.save()
-        # Clean up temp JPEGs
-        for jpeg_path in temp_jpegs:
-            try:
-                os.remove(jpeg_path)
-            except Exception:
-                pass
+        if pdf_path is not None and buf is not None:
+            # getbuffer() is a zero-copy view over the finished document
+            with open(pdf_path, "wb") as f:
+                f.write(buf.getbuffer())
         if artifact is not None:
             artifact["book"] = pdf_path
             artifact["book_filename"] = pdf_filename
+        if stream is not None:
+            logging.info("[BookAssemblerAgent] PDF written to in-memory stream")
+            return stream
         logging.info(f"[BookAssemblerAgent] PDF saved to: {pdf_path}")
         return pdf_path
 
@@ -696,12 +982,10 @@ class BookCreationWorkflow(SequentialAgent):
                 StoryGeneratorAgent(name="StoryGeneratorAgent"),
                 StoryElementsAgent(name="StoryElementsAgent"),
                 CoherenceAgent(name="CoherenceAgent"),
-                ParallelAgent(
-                    name="ParallelMediaAgent",
-                    sub_agents=[
-                        IllustrationGeneratorAgent(name="IllustrationGeneratorAgent"),
-                    ],
-                ),
+                # Per-prompt fan-out happens inside IllustrationGeneratorAgent
+                # (MAX_CONCURRENCY workers behind the Imagen rate limiter), so
+                # a single-child ParallelAgent wrapper added nothing
+                IllustrationGeneratorAgent(name="IllustrationGeneratorAgent"),
                 BookAssemblerAgent(name="BookAssemblerAgent"),
             ],
         )
@@ -719,15 +1003,17 @@ class BookCreationWorkflow(SequentialAgent):
         logging.info("[BookCreationWorkflow] After StoryElementsAgent")
         prompts = self.sub_agents[3].run(story, processed, memory=memory)
         logging.info("[BookCreationWorkflow] After CoherenceAgent")
-        illustrations = self.sub_agents[4].sub_agents[0].run(
+        illustrations = self.sub_agents[4].run(
             prompts, None, memory=memory, artifact=artifact
         )
         logging.info("[BookCreationWorkflow] After IllustrationGeneratorAgent")
-        scenes = memory["scenes"] if "scenes" in memory else [story]
-        character = elements.get("character") if isinstance(elements, dict) else processed.get("character_name", "A Friend")
-        setting = elements.get("setting") if isinstance(elements, dict) else processed.get("setting", "A Magical Place")
-        title = f"{character} in {setting}"
-        pdf = self.sub_agents[5].run(scenes, illustrations, title=title, artifact=artifact)
+        scenes = memory.get("scenes", [story])
+        el = elements if isinstance(elements, dict) else {}
+        character = el.get("character", processed.get("character_name", "A Friend"))
+        setting = el.get("setting", processed.get("setting", "A Magical Place"))
+        pdf = self.sub_agents[5].run(
+            scenes, illustrations, character=character, setting=setting, artifact=artifact
+        )
         logging.info("[BookCreationWorkflow] After BookAssemblerAgent")
         return {
             "story": story,
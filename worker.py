@@ -0,0 +1,35 @@
+"""Long-lived worker that consumes book-generation jobs from Redis.
+
+Run alongside the API server (one or more processes):
+
+    python worker.py
+
+`/api/generate-book` pushes session IDs onto the `book_jobs` list; each
+worker pops one at a time and runs the existing pipeline. Progress is
+reported through the Firestore session `status` field, so the API and
+frontend are unchanged.
+"""
+
+import logging
+
+from api_server import BOOK_JOBS_QUEUE, redis_client, run_book_generation
+
+logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
+
+
+def main():
+    logging.info(f"[worker] Waiting for jobs on '{BOOK_JOBS_QUEUE}'")
+    while True:
+        _, session_id = redis_client.blpop(BOOK_JOBS_QUEUE)
+        session_id = session_id.decode()
+        logging.info(f"[worker] Starting book generation for session {session_id}")
+        try:
+            run_book_generation(session_id)
+        except Exception as e:
+            logging.error(f"[worker] Job {session_id} failed: {e}")
+        else:
+            logging.info(f"[worker] Finished session {session_id}")
+
+
+if __name__ == "__main__":
+    main()